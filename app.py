@@ -1,39 +1,122 @@
 # app.py
 import os
+import hashlib
+import threading
+import cachetools
 import cloudinary
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, url_for
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 import db_service
-from datetime import datetime
-import hashlib
-import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import orjson
 import re
+import functools
+import secrets
+import shutil
+import tempfile
+from urllib.parse import unquote
 import logging
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Импортируем наши новые сервисы
 import shotstack_service
 import cloudinary_service
 import db_service
+import cache_service
 
 # --- Configure Logging ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# One root handler configured once at import; LOG_LEVEL=WARNING silences the per-request INFO lines
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# --- JSON Serialization ---
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson (C implementation), used by jsonify and request.get_json.
+    Types orjson can't encode natively fall back to Flask's default() handler.
+    Datetimes are encoded natively; naive ones (DB timestamps are stored in UTC) get a +00:00 offset.
+    Non-string dict keys (ints, etc.) are stringified like the stdlib json module does.
+    """
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+# Reject oversized uploads before any of the body is read (multipart and raw octet-stream alike)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', '500')) * 1024 * 1024
 
 # --- CORS Configuration ---
-CORS(app, resources={r"/*": {"origins": [
+_ALLOWED_ORIGINS = frozenset([
     "https://megafox3000.github.io",
     "http://localhost:5500",
     "http://127.0.0.1:5500"
-], "methods": ["GET", "POST", "OPTIONS", "HEAD"], "allow_headers": ["Content-Type", "Authorization", "X-Requested-With"]}}, supports_credentials=True)
-
-# ИНИЦИАЛИЗАЦИЯ БАЗЫ ДАННЫХ ПРИ СТАРТЕ ПРИЛОЖЕНИЯ
-with app.app_context():
+])
+_CORS_METHODS = ["GET", "POST", "OPTIONS", "HEAD"]
+_CORS_HEADERS = ["Content-Type", "Authorization", "X-Requested-With", "X-Filename", "X-Instagram-Username", "X-Email", "X-Linkedin-Profile"]
+CORS_MAX_AGE_SECONDS = 86400
+
+CORS(app, resources={r"/*": {"origins": list(_ALLOWED_ORIGINS), "methods": _CORS_METHODS, "allow_headers": _CORS_HEADERS}},
+     supports_credentials=True, max_age=CORS_MAX_AGE_SECONDS)
+
+# Preflight headers are the same for every route, so build them once
+_PREFLIGHT_HEADERS = {
+    "Access-Control-Allow-Methods": ", ".join(_CORS_METHODS),
+    "Access-Control-Allow-Headers": ", ".join(_CORS_HEADERS),
+    "Access-Control-Allow-Credentials": "true",
+    "Access-Control-Max-Age": str(CORS_MAX_AGE_SECONDS),
+    "Vary": "Origin"
+}
+
+@app.before_request
+def answer_cors_preflight():
+    """
+    Answers CORS preflights from known origins directly with the precomputed headers,
+    skipping routing and flask_cors' per-request header resolution. Max-Age lets the
+    browser reuse the preflight for a day. Other OPTIONS requests fall through to flask_cors.
+    """
+    if request.method == 'OPTIONS':
+        origin = request.headers.get('Origin')
+        if origin in _ALLOWED_ORIGINS and request.headers.get('Access-Control-Request-Method'):
+            return app.response_class(status=204, headers={**_PREFLIGHT_HEADERS, "Access-Control-Allow-Origin": origin})
+
+# --- Rate Limiting ---
+# Render's proxy sets X-Forwarded-For/-Proto; trust one hop so limits apply per client, not per proxy
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1)
+# Only the routes that start uploads or renders are limited (status polling is not).
+# Counters live in Redis when it's configured, so they are shared by all workers.
+limiter = Limiter(get_remote_address, app=app, storage_uri=os.environ.get('REDIS_URL') or "memory://")
+
+@app.teardown_request
+def remove_db_session(exc=None):
+    """Releases the request's scoped database session."""
+    db_service.Session.remove()
+
+# ИНИЦИАЛИЗАЦИЯ БАЗЫ ДАННЫХ: выполняется один раз при деплое (`flask --app app init-db`),
+# а не при импорте модуля каждым воркером gunicorn.
+@app.cli.command("init-db")
+def init_db():
+    """Creates the database tables if they don't exist yet."""
     db_service.create_tables()
 
+@app.cli.command("compact-metadata")
+def compact_metadata():
+    """Strips video_metadata of existing uploads down to the Cloudinary fields the app uses."""
+    # 'gps' is kept: it holds coordinates extracted from the video's tags, not Cloudinary fields
+    db_service.compact_video_metadata(cloudinary_service.VIDEO_METADATA_KEYS + ("gps",))
+
 # Конфигурация Cloudinary
 cloudinary.config(
     cloud_name = os.environ.get('CLOUDINARY_CLOUD_NAME'),
@@ -42,58 +125,91 @@ cloudinary.config(
     secure = True
 )
 
-# ----------- GPS & METADATA FUNCTIONS (без изменений) -----------
+# ----------- GPS & METADATA FUNCTIONS -----------
+_GPS_KEY_MARKERS = ("location", "gps")
+# Latitude and longitude at the start of an ISO 6709 string, e.g. "+55.7558+037.6173/"
+_ISO6709_RE = re.compile(r"^([\+\-]\d+(?:\.\d+)?)([\+\-]\d+(?:\.\d+)?)")
+
 def parse_gps_tags(tags):
-    gps_data = {}
-    for key, value in tags.items():
-        if "location" in key.lower() or "gps" in key.lower():
-            gps_data[key] = value
-    return gps_data
+    return {key: value for key, value in tags.items()
+            if any(marker in key.lower() for marker in _GPS_KEY_MARKERS)}
 
 def extract_coordinates_from_tags(tags):
+    """
+    Extracts ISO6709 coordinates from metadata tags.
+    """
     gps_data = []
     for key, value in tags.items():
-        if "ISO6709" in key and re.match(r"^[\+\-]\d+(\.\d+)?[\+\-]\d+(\.\d+)?", str(value)):
-            match = re.match(r"^([\+\-]\d+(\.\d+)?)([\+\-]\d+(\.\d+)?).*", str(value))
-            if match:
-                lat = match.group(1)
-                lon = match.group(3)
-                link = f"https://www.google.com/maps/search/?api=1&query={lat},{lon}"
-                address = reverse_geocode(lat, lon)
-                gps_data.append({
-                    "tag": key,
-                    "latitude": float(lat),
-                    "longitude": float(lon),
-                    "link": link,
-                    "address": address
-                })
+        # Cheap case-insensitive substring check first: only a handful of tags ever reach the regex
+        if "iso6709" not in key.lower():
+            continue
+        match = _ISO6709_RE.match(str(value))
+        if not match:
+            continue
+        lat, lon = match.group(1), match.group(2)
+        link = f"https://www.google.com/maps/search/?api=1&query={lat},{lon}"
+        gps_data.append({
+            "tag": key,
+            "latitude": float(lat),
+            "longitude": float(lon),
+            "link": link,
+            "address": reverse_geocode(lat, lon)
+        })
     return gps_data
 
+# Shared HTTP session: consecutive geocoding calls reuse the TCP+TLS connection
+_http = requests.Session()
+_http.headers.update({"User-Agent": "VideoMetaApp/1.0"})
+# Nominatim throttles at ~1 request/second: back off 1s, 2s, 4s and honour Retry-After on 429/503
+_http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(
+    total=3, backoff_factor=1.0, status_forcelist=(429, 502, 503, 504), allowed_methods=("GET",), raise_on_status=False)))
+# (connect, read) timeouts: a slow Nominatim gets the full 15s it may need instead of timing out
+# and being retried; a dead host still fails fast on connect
+GEOCODE_TIMEOUT = (3, 15)
+
 def reverse_geocode(lat, lon):
+    # Rounding to 3 decimals (~110 m, still well below zoom=14 resolution) collapses near-identical fixes
+    lat, lon = round(float(lat), 3), round(float(lon), 3)
     try:
-        url = "https://nominatim.openstreetmap.org/reverse"
-        params = {
-            "lat": lat,
-            "lon": lon,
-            "format": "json",
-            "zoom": 14,
-            "addressdetails": 1
-        }
-        headers = {"User-Agent": "VideoMetaApp/1.0"}
-        response = requests.get(url, params=params, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("display_name", "Address not found.")
+        return _lookup_address(lat, lon)
     except requests.exceptions.RequestException as e:
-        logger.error(f"Geocoding error: {e}")
+        logger.error("Geocoding error: %s", e)
         return f"Geocoding error: {e}"
     except json.JSONDecodeError:
-        logger.error(f"Geocoding error: Could not decode JSON from response.")
+        logger.error("Geocoding error: Could not decode JSON from response.")
         return "Geocoding error: Invalid response from geocoding service."
 
+@functools.lru_cache(maxsize=4096)
+def _lookup_address(lat, lon):
+    """
+    Resolves rounded coordinates to an address: in-process LRU first, then Redis, then Nominatim.
+    Errors are raised rather than returned, so failed lookups are never cached.
+    """
+    # Videos shot at the same place share coordinates, so most lookups are cache hits
+    cached_address = cache_service.get_geocode(lat, lon)
+    if cached_address is not None:
+        return cached_address
+    url = "https://nominatim.openstreetmap.org/reverse"
+    params = {
+        "lat": lat,
+        "lon": lon,
+        "format": "json",
+        "zoom": 14,
+        "addressdetails": 1
+    }
+    response = _http.get(url, params=params, timeout=GEOCODE_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+    address = data.get("display_name", "Address not found.")
+    cache_service.set_geocode(lat, lon, address)
+    return address
+
 # ----------- API ENDPOINTS -----------
 # This section contains all the route definitions for the Flask application.
 
+# Task statuses that never change again without an explicit user action
+TERMINAL_STATUSES = ('completed', 'failed', 'concatenated_completed', 'concatenated_failed')
+
 @app.route('/')
 def index():
     """
@@ -103,65 +219,228 @@ def index():
     return jsonify({"status": "✅ Python Backend is up and running!"})
 
 
+# Uploads up to this size stay in memory while queued; larger files spill to a temp file on disk
+UPLOAD_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+# Copy buffer for spooling: 1 MB writes instead of the 64 KB default
+UPLOAD_COPY_BUFFER_SIZE = 1024 * 1024
+_UPLOAD_EXECUTOR = ThreadPoolExecutor(max_workers=cloudinary_service.UPLOAD_CONCURRENCY, thread_name_prefix="upload")
+
+# An upload still 'uploading' after this long will never finish: the browser abandoned its
+# direct upload (so no webhook is coming) or the worker running the background job restarted.
+UPLOAD_GRACE_PERIOD = timedelta(hours=1)
+
+def _is_upload_in_grace_period(created_at):
+    """Tells whether an 'uploading' task created at created_at may still complete."""
+    if created_at is None:
+        return False
+    if isinstance(created_at, str):  # SQLite returns DATETIME columns as strings
+        created_at = datetime.fromisoformat(created_at)
+    if created_at.tzinfo is None:  # DB timestamps are stored in UTC
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - created_at < UPLOAD_GRACE_PERIOD
+
+def _upload_in_background(task_id, spooled_file, original_filename, instagram_username):
+    """
+    Background job: pushes a spooled upload to Cloudinary and fills in the task row
+    created by upload_video() with the result (or marks it failed).
+    """
+    try:
+        upload_result = cloudinary_service.upload_video_to_cloudinary(
+            file_stream=spooled_file,
+            original_filename=original_filename,
+            instagram_username=instagram_username
+        )
+        updates = {
+            "cloudinary_public_id": upload_result.get('public_id'),
+            "status": 'completed',
+            "cloudinary_url": upload_result.get('secure_url'),
+            "video_metadata": cloudinary_service.project_video_metadata(upload_result),
+            "message": "Video uploaded successfully."
+        }
+        logger.info("[UPLOAD] Task '%s' uploaded to Cloudinary.", task_id)
+    except Exception as e:
+        logger.exception("[UPLOAD] Cloudinary upload failed for task '%s':", task_id)
+        updates = {"status": 'failed', "message": f"Cloudinary upload failed: {e}"}
+    finally:
+        spooled_file.close()
+
+    try:
+        db_service.update_task_fields(task_id, updates)
+        _invalidate_tasks(task_id)
+    except Exception:
+        logger.exception("[UPLOAD] Failed to store upload result for task '%s':", task_id)
+
 @app.route('/upload_video', methods=['POST'])
+@limiter.limit("60/minute")
 def upload_video():
     """
-    Handles video file uploads. It uploads the file to Cloudinary,
-    then creates a corresponding task record in the database.
+    Handles video file uploads. The file is spooled locally, a task record with
+    status 'uploading' is created, and the Cloudinary upload runs in the background.
+    Returns 202; the frontend polls /task-status until the task is 'completed' or 'failed'.
+
+    Accepts either a multipart form (field 'video' plus form identifiers) or a raw
+    'application/octet-stream' body with the filename and identifiers in X-Filename,
+    X-Instagram-Username, X-Email and X-Linkedin-Profile headers (URL-encoded). The raw
+    body is read straight from the request stream, skipping Werkzeug's multipart temp file.
     """
     try:
         # --- File and Form Validation ---
-        if 'video' not in request.files:
-            logger.warning("[UPLOAD] No video file provided in request.")
-            return jsonify({"error": "No video file provided"}), 400
+        if request.mimetype == 'application/octet-stream':
+            filename = unquote(request.headers.get('X-Filename', ''))
+            if not filename:
+                logger.warning("[UPLOAD] No X-Filename header for raw upload.")
+                return jsonify({"error": "X-Filename header is required"}), 400
+            source_stream = request.stream
+            instagram_username = unquote(request.headers.get('X-Instagram-Username', '')) or None
+            email = unquote(request.headers.get('X-Email', '')) or None
+            linkedin_profile = unquote(request.headers.get('X-Linkedin-Profile', '')) or None
+        else:
+            if 'video' not in request.files:
+                logger.warning("[UPLOAD] No video file provided in request.")
+                return jsonify({"error": "No video file provided"}), 400
 
-        file = request.files['video']
-        if file.filename == '':
-            logger.warning("[UPLOAD] No selected video file.")
-            return jsonify({"error": "No selected video file"}), 400
+            file = request.files['video']
+            if file.filename == '':
+                logger.warning("[UPLOAD] No selected video file.")
+                return jsonify({"error": "No selected video file"}), 400
+            filename = file.filename
+            source_stream = file.stream
 
-        instagram_username = request.form.get('instagram_username')
-        email = request.form.get('email')
-        linkedin_profile = request.form.get('linkedin_profile')
+            instagram_username = request.form.get('instagram_username')
+            email = request.form.get('email')
+            linkedin_profile = request.form.get('linkedin_profile')
 
         if not any([instagram_username, email, linkedin_profile]):
              return jsonify({"error": "At least one identifier (Instagram, Email, etc.) is required"}), 400
 
-        # --- Cloudinary Upload ---
-        logger.info(f"Calling Cloudinary service for file: '{file.filename}'")
-        upload_result = cloudinary_service.upload_video_to_cloudinary(
-            file_stream=file,
-            original_filename=file.filename,
-            instagram_username=instagram_username
-        )
-        
+        # --- Spool the file ---
+        # The request stream is gone once this handler returns, so copy it out first
+        spooled_file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_SIZE)
+        shutil.copyfileobj(source_stream, spooled_file, UPLOAD_COPY_BUFFER_SIZE)
+        spooled_file.seek(0)
+
         # --- Database Task Creation ---
-        # Generate a unique task_id for our system
-        task_id = f"{instagram_username or 'anon'}/{os.path.splitext(file.filename)[0]}_{upload_result.get('asset_id', 'xxxx')[-8:]}"
-        
+        # Generate a unique task_id for our system (the Cloudinary asset_id isn't known yet)
+        task_id = f"{instagram_username or 'anon'}/{os.path.splitext(filename)[0]}_{secrets.token_hex(4)}"
+
         # Prepare the data for the new database record
         task_data = {
             "task_id": task_id,
-            "cloudinary_public_id": upload_result.get('public_id'),
             "instagram_username": instagram_username,
             "email": email,
             "linkedin_profile": linkedin_profile,
-            "original_filename": file.filename,
-            "status": 'completed',
-            "cloudinary_url": upload_result.get('secure_url'),
-            "video_metadata": upload_result,
-            "message": "Video uploaded successfully."
+            "original_filename": filename,
+            "status": 'uploading',
+            "message": "Video is being uploaded to Cloudinary."
         }
 
-        # Add the new task to the database. db_service now returns a dictionary.
-        new_task_dict = db_service.add_task(task_data)
-        logger.info(f"Task '{task_id}' successfully created in DB.")
-        
+        # Insert the task in a single round-trip. db_service returns a dictionary.
+        try:
+            new_task_dict = db_service.upsert_task(task_data)
+        except Exception:
+            spooled_file.close()
+            raise
+        _invalidate_tasks(task_id)
+        logger.info("Task '%s' saved in DB, queuing Cloudinary upload for '%s'.", task_id, filename)
+
+        # --- Cloudinary Upload (background) ---
+        _UPLOAD_EXECUTOR.submit(_upload_in_background, task_id, spooled_file, filename, instagram_username)
+
         # Return the newly created task data (already in dict format) to the frontend
-        return jsonify(new_task_dict), 201
+        return jsonify(new_task_dict), 202
+
+    except RequestEntityTooLarge:
+        logger.warning("[UPLOAD] Rejected upload larger than %s bytes.", app.config['MAX_CONTENT_LENGTH'])
+        return jsonify({"error": "Video file is too large"}), 413
+    except Exception as e:
+        logger.exception("An unexpected error occurred during upload:")
+        return jsonify({'error': 'An unexpected server error occurred', 'details': str(e)}), 500
+
+
+@app.route('/sign-upload', methods=['POST'])
+@limiter.limit("60/minute")
+def sign_upload():
+    """
+    Prepares a direct browser-to-Cloudinary upload: creates the task record with
+    status 'uploading' and returns signed upload parameters. The file never passes
+    through this server; /cloudinary-webhook completes the task once Cloudinary has it.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = data.get('filename')
+        instagram_username = data.get('instagram_username')
+        email = data.get('email')
+        linkedin_profile = data.get('linkedin_profile')
+
+        if not filename:
+            return jsonify({"error": "filename is required"}), 400
+        if not any([instagram_username, email, linkedin_profile]):
+            return jsonify({"error": "At least one identifier (Instagram, Email, etc.) is required"}), 400
+
+        notification_url = os.environ.get('CLOUDINARY_NOTIFICATION_URL') or url_for('cloudinary_webhook', _external=True)
+        upload_params = cloudinary_service.sign_direct_upload(filename, instagram_username, notification_url)
+
+        task_id = f"{instagram_username or 'anon'}/{os.path.splitext(filename)[0]}_{secrets.token_hex(4)}"
+        task_data = {
+            "task_id": task_id,
+            "cloudinary_public_id": upload_params['public_id'],
+            "instagram_username": instagram_username,
+            "email": email,
+            "linkedin_profile": linkedin_profile,
+            "original_filename": filename,
+            "status": 'uploading',
+            "message": "Waiting for the direct upload to Cloudinary."
+        }
+        new_task_dict = db_service.upsert_task(task_data)
+        _invalidate_tasks(task_id)
+        logger.info("[SIGN_UPLOAD] Task '%s' created for direct upload of '%s'.", task_id, filename)
+
+        return jsonify({**new_task_dict, "upload": upload_params}), 201
 
     except Exception as e:
-        logger.exception(f"An unexpected error occurred during upload:")
+        logger.exception("[SIGN_UPLOAD] Error while signing upload:")
+        return jsonify({'error': 'An unexpected server error occurred', 'details': str(e)}), 500
+
+
+@app.route('/cloudinary-webhook', methods=['POST'])
+def cloudinary_webhook():
+    """
+    Receives Cloudinary upload notifications for direct uploads (see /sign-upload)
+    and fills in the matching task record.
+    """
+    body = request.get_data(as_text=True)
+    try:
+        timestamp = int(request.headers.get('X-Cld-Timestamp', ''))
+    except ValueError:
+        return jsonify({"error": "Invalid notification signature"}), 401
+    if not cloudinary_service.verify_notification(body, timestamp, request.headers.get('X-Cld-Signature', '')):
+        logger.warning("[WEBHOOK] Rejected Cloudinary notification with an invalid signature.")
+        return jsonify({"error": "Invalid notification signature"}), 401
+
+    try:
+        notification = orjson.loads(body)
+        if notification.get('notification_type') != 'upload':
+            return jsonify({"status": "ignored"}), 200
+
+        public_id = notification.get('public_id')
+        task = db_service.get_task_by_public_id(public_id)
+        if not task:
+            # Acknowledge anyway so Cloudinary doesn't keep retrying
+            logger.warning("[WEBHOOK] No task found for Cloudinary public_id '%s'.", public_id)
+            return jsonify({"status": "ignored"}), 200
+
+        db_service.update_task_fields(task.task_id, {
+            "status": 'completed',
+            "cloudinary_url": notification.get('secure_url'),
+            "video_metadata": cloudinary_service.project_video_metadata(notification),
+            "message": "Video uploaded successfully."
+        })
+        _invalidate_tasks(task.task_id)
+        logger.info("[WEBHOOK] Task '%s' completed by Cloudinary notification.", task.task_id)
+        return jsonify({"status": "ok"}), 200
+
+    except Exception as e:
+        logger.exception("[WEBHOOK] Error while processing Cloudinary notification:")
         return jsonify({'error': 'An unexpected server error occurred', 'details': str(e)}), 500
 
 
@@ -174,7 +453,7 @@ def delete_video(public_id):
     if not public_id:
         return jsonify({"message": "Public ID is required"}), 400
 
-    logger.info(f"[DELETE] Request for public_id: {public_id}")
+    logger.info("[DELETE] Request for public_id: %s", public_id)
     try:
         # Step 1: Delete the resource from Cloudinary
         cloudinary_service.delete_video(public_id)
@@ -184,65 +463,216 @@ def delete_video(public_id):
         
         # Step 3: If a corresponding task is found, delete it from our database
         if task_object:
-            db_service.delete_task_by_id(task_object.id)
+            db_service.delete_task_by_id(task_object.task_id)
+            _invalidate_tasks(task_object.task_id)
         else:
-            logger.warning(f"Video with public_id '{public_id}' was deleted from Cloudinary, but no matching task was found in the DB.")
+            logger.warning("Video with public_id '%s' was deleted from Cloudinary, but no matching task was found in the DB.", public_id)
         
         # Return 204 No Content, which is the standard for a successful DELETE request
         return ('', 204)
         
     except Exception as e:
-        logger.error(f"[DELETE] Error deleting video '{public_id}': {e}", exc_info=True)
+        logger.error("[DELETE] Error deleting video '%s': %s", public_id, e, exc_info=True)
         return jsonify({"message": f"An error occurred: {str(e)}"}), 500
 
 
+# Upper bound on the number of ids accepted by the batch /task-status endpoint
+MAX_BATCH_STATUS_IDS = 100
+
+# Fields returned by /task-status/<task_id>?light=1
+_LIGHT_STATUS_KEYS = ('taskId', 'status', 'message', 'timestamp')
+
+# In-process tier in front of Redis for serialized final-state tasks. Writes made by this
+# worker evict it through _invalidate_tasks(); the short TTL bounds how long another worker's
+# change (e.g. a new render) can go unnoticed here.
+_STATUS_CACHE = cachetools.TTLCache(maxsize=10_000, ttl=3)
+_STATUS_CACHE_LOCK = threading.Lock()
+
+def _invalidate_tasks(*task_ids):
+    """Drops the given tasks from both cache tiers. Must be called after every task write."""
+    with _STATUS_CACHE_LOCK:
+        for task_id in task_ids:
+            _STATUS_CACHE.pop(task_id, None)
+    cache_service.invalidate_tasks(*task_ids)
+
+def _get_cached_task_json(task_id):
+    """Looks a final-state task up in the in-process cache, then in Redis (promoting hits)."""
+    with _STATUS_CACHE_LOCK:
+        cached_json = _STATUS_CACHE.get(task_id)
+    if cached_json is None:
+        cached_json = cache_service.get_task_json(task_id)
+        if cached_json is not None:
+            with _STATUS_CACHE_LOCK:
+                _STATUS_CACHE[task_id] = cached_json
+    return cached_json
+
+def _status_response(payload):
+    """
+    Wraps a serialized task in a JSON response with a strong ETag and a short
+    Cache-Control, answering 304 Not Modified if the client already has this version.
+    """
+    response = app.response_class(payload, status=200, mimetype='application/json')
+    response.set_etag(hashlib.blake2b(payload, digest_size=8).hexdigest())
+    response.headers['Cache-Control'] = 'private, max-age=2'
+    return response.make_conditional(request)
+
+# Single-flight for Shotstack status checks: render_id -> (Event, result box) of the call in progress
+_INFLIGHT_RENDER_CHECKS = {}
+_INFLIGHT_LOCK = threading.Lock()
+# How long a poll waits for another client's in-flight check before asking Shotstack itself
+SINGLE_FLIGHT_WAIT_SECONDS = 5
+
+def _get_render_status_single_flight(render_id):
+    """
+    Calls shotstack_service.get_shotstack_render_status, but lets concurrent polls of the
+    same render share one Shotstack request: late arrivals wait for the in-flight call
+    and reuse its result (or its exception).
+    """
+    with _INFLIGHT_LOCK:
+        inflight = _INFLIGHT_RENDER_CHECKS.get(render_id)
+        if inflight is None:
+            event, box = threading.Event(), {}
+            _INFLIGHT_RENDER_CHECKS[render_id] = (event, box)
+
+    if inflight is not None:
+        event, box = inflight
+        if event.wait(timeout=SINGLE_FLIGHT_WAIT_SECONDS):
+            if 'error' in box:
+                raise box['error']
+            return box['result']
+        # The other call is taking too long; don't hold this request hostage to it
+        return shotstack_service.get_shotstack_render_status(render_id)
+
+    try:
+        box['result'] = shotstack_service.get_shotstack_render_status(render_id)
+        return box['result']
+    except Exception as e:
+        box['error'] = e
+        raise
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT_RENDER_CHECKS.pop(render_id, None)
+        event.set()
+
+def _refresh_task_status(task_id, task_dict):
+    """
+    If the task is being processed by Shotstack, polls the Shotstack API for the latest
+    status and stores any change in the database. Tasks that end up in a final state are
+    cached. Returns task_dict (updated in place).
+    """
+    # Check if we need to poll Shotstack for an update
+    render_id = task_dict.get('shotstackRenderId')
+    current_status = task_dict.get('status')
+
+    if render_id and current_status not in TERMINAL_STATUSES:
+        logger.info("[STATUS] Task %s has a Shotstack render ID. Checking API...", task_id)
+
+        status_info = _get_render_status_single_flight(render_id)
+        shotstack_status = status_info.get('status')
+
+        updates = {}
+        # Logic to determine if the status has changed based on Shotstack's response
+        if shotstack_status == 'done':
+            updates['status'] = 'concatenated_completed' if task_id.startswith('concatenated_') else 'completed'
+            updates['message'] = "Render completed successfully."
+            updates['shotstackUrl'] = status_info.get('url')
+            updates['posterUrl'] = status_info.get('poster')
+        elif shotstack_status in ['failed', 'error']:
+            updates['status'] = 'concatenated_failed' if task_id.startswith('concatenated_') else 'failed'
+            updates['message'] = status_info.get('error_message', 'Render failed in Shotstack.')
+
+        # If there are changes, update the database
+        if updates:
+            logger.info("Updating task %s with new status: %s", task_id, updates.get('status'))
+            db_service.update_task_fields(task_id, updates)
+            # Apply the same changes to the dict we already have instead of re-reading the row
+            task_dict.update(db_service.row_to_dict(updates))
+
+    # Only final states are cached: anything else may still change on the next poll
+    if task_dict.get('status') in TERMINAL_STATUSES:
+        cache_service.set_task(task_id, task_dict)
+
+    return task_dict
+
+@app.route('/task-status', methods=['GET'])
+def get_tasks_status():
+    """
+    Batch version of /task-status/<task_id> for frontends polling several uploads:
+    /task-status?ids=a,b,c returns a JSON array with the tasks that exist, in request order.
+    Cached tasks come from one Redis MGET; the rest are loaded with one IN query.
+    """
+    try:
+        task_ids = list(dict.fromkeys(i for i in request.args.get('ids', '').split(',') if i))
+        if not task_ids:
+            return jsonify({"error": "The 'ids' query parameter is required."}), 400
+        if len(task_ids) > MAX_BATCH_STATUS_IDS:
+            return jsonify({"error": f"At most {MAX_BATCH_STATUS_IDS} ids can be requested at once."}), 400
+
+        cached = dict(zip(task_ids, cache_service.get_tasks_json(task_ids)))
+        missing_ids = [task_id for task_id, task_json in cached.items() if task_json is None]
+        task_dicts = db_service.get_tasks_by_ids(missing_ids)
+
+        parts = []
+        for task_id in task_ids:
+            if cached[task_id] is not None:
+                parts.append(cached[task_id])
+            elif task_id in task_dicts:
+                task_dict = _refresh_task_status(task_id, task_dicts[task_id])
+                parts.append(orjson.dumps(task_dict, option=orjson.OPT_NAIVE_UTC))
+
+        return app.response_class(b'[' + b','.join(parts) + b']', status=200, mimetype='application/json')
+
+    except Exception as e:
+        logger.exception("[STATUS] An unexpected error occurred in get_tasks_status:")
+        return jsonify({"error": "An unexpected server error occurred", "details": str(e)}), 500
+
+
 @app.route('/task-status/<path:task_id>', methods=['GET'])
 def get_task_status(task_id):
     """
     Retrieves the status of a specific task. If the task is being processed by Shotstack,
     it polls the Shotstack API for the latest status and updates the database.
+    With ?light=1 only taskId, status, message and timestamp are returned.
     """
     try:
-        logger.info(f"[STATUS] Request for task_id: '{task_id}'")
+        logger.info("[STATUS] Request for task_id: '%s'", task_id)
+
+        light = request.args.get('light') == '1'
+        if light:
+            # Narrow SELECT without video_metadata; enough unless a Shotstack render needs polling
+            light_dict = db_service.get_task_status_light(task_id)
+            if not light_dict:
+                logger.warning("[STATUS] Task '%s' NOT FOUND in DB.", task_id)
+                return jsonify({"message": "Task not found."}), 404
+            render_id = light_dict.pop('shotstackRenderId')
+            if not render_id or light_dict.get('status') in TERMINAL_STATUSES:
+                return _status_response(orjson.dumps(light_dict, option=orjson.OPT_NAIVE_UTC))
+
+        # Tasks in a final state are served straight from the caches (already serialized JSON).
+        # Light requests only get here for a render in flight, which is never cached.
+        cached_json = None if light else _get_cached_task_json(task_id)
+        if cached_json is not None:
+            return _status_response(cached_json)
+
         # CHANGED: db_service.get_task_by_id now returns a dictionary or None
         task_dict = db_service.get_task_by_id(task_id)
 
         if not task_dict:
-            logger.warning(f"[STATUS] Task '{task_id}' NOT FOUND in DB.")
+            logger.warning("[STATUS] Task '%s' NOT FOUND in DB.", task_id)
             return jsonify({"message": "Task not found."}), 404
 
-        # Check if we need to poll Shotstack for an update
-        render_id = task_dict.get('shotstackRenderId')
-        current_status = task_dict.get('status')
-        
-        if render_id and current_status not in ['completed', 'failed', 'concatenated_completed', 'concatenated_failed']:
-            logger.info(f"[STATUS] Task {task_id} has a Shotstack render ID. Checking API...")
-            
-            status_info = shotstack_service.get_shotstack_render_status(render_id)
-            shotstack_status = status_info.get('status')
-            
-            updates = {}
-            # Logic to determine if the status has changed based on Shotstack's response
-            if shotstack_status == 'done':
-                updates['status'] = 'concatenated_completed' if task_id.startswith('concatenated_') else 'completed'
-                updates['message'] = "Render completed successfully."
-                updates['shotstackUrl'] = status_info.get('url')
-                updates['posterUrl'] = status_info.get('poster')
-            elif shotstack_status in ['failed', 'error']:
-                updates['status'] = 'concatenated_failed' if task_id.startswith('concatenated_') else 'failed'
-                updates['message'] = status_info.get('error_message', 'Render failed in Shotstack.')
-            
-            # If there are changes, update the database
-            if updates:
-                logger.info(f"Updating task {task_id} with new status: {updates.get('status')}")
-                # The update function returns the updated dictionary
-                task_dict = db_service.update_task_by_id(task_id, updates)
-
-        # Return the latest task data (either original or updated)
-        return jsonify(task_dict), 200
+        # Poll Shotstack if needed; returns the latest task data (either original or updated)
+        task_dict = _refresh_task_status(task_id, task_dict)
+        if light:
+            return _status_response(orjson.dumps({key: task_dict.get(key) for key in _LIGHT_STATUS_KEYS}, option=orjson.OPT_NAIVE_UTC))
+        payload = orjson.dumps(task_dict, option=orjson.OPT_NAIVE_UTC)
+        if task_dict.get('status') in TERMINAL_STATUSES:
+            with _STATUS_CACHE_LOCK:
+                _STATUS_CACHE[task_id] = payload
+        return _status_response(payload)
 
     except Exception as e:
-        logger.exception(f"[STATUS] An unexpected error occurred in get_task_status:")
+        logger.exception("[STATUS] An unexpected error occurred in get_task_status:")
         return jsonify({"error": "An unexpected server error occurred", "details": str(e)}), 500
 
 
@@ -288,22 +718,62 @@ def generate_shotstack_video():
             connect_videos=False
         )
 
-        db_service.update_task_by_id(task_id, {
+        db_service.update_task_fields(task_id, {
             "status": 'shotstack_pending',
             "message": f"Shotstack render initiated with ID: {render_id}",
             "shotstackRenderId": render_id
         })
+        _invalidate_tasks(task_id)
         return jsonify({
             "message": "Shotstack render initiated successfully.",
             "shotstackRenderId": render_id
         }), 200
 
     except Exception as e:
-        logger.exception(f"[SHOTSTACK] An unexpected error occurred:")
+        logger.exception("[SHOTSTACK] An unexpected error occurred:")
         return jsonify({"error": "An unexpected server error occurred.", "details": str(e)}), 500
 
 
+# Pool for concurrent Shotstack render requests issued by /process_videos
+_SHOTSTACK_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="shotstack")
+
+# A 'concatenated_pending' task gets its render id within seconds (the Shotstack call times out
+# after 30s). One still without a render id after this long lost its background job to a worker
+# restart or redeploy, and nothing else will ever pick it up, so it may be claimed again.
+CONCAT_SUBMIT_GRACE_PERIOD = timedelta(minutes=2)
+
+def _concatenate_in_background(concatenated_task_id, cloudinary_video_urls, all_tasks_metadata, instagram_username, email, linkedin_profile):
+    """
+    Background job: submits a concatenation render to Shotstack and stores the render id
+    on the 'concatenated_pending' task created by process_videos() (or marks it failed).
+    """
+    try:
+        render_id, _ = shotstack_service.initiate_shotstack_render(
+            cloudinary_video_url_or_urls=cloudinary_video_urls,
+            video_metadata=all_tasks_metadata,
+            original_filename=concatenated_task_id,
+            connect_videos=True,
+            instagram_username=instagram_username,
+            email=email,
+            linkedin_profile=linkedin_profile
+        )
+        updates = {
+            "shotstackRenderId": render_id,
+            "message": f"Shotstack render initiated with ID: {render_id}"
+        }
+        logger.info("[PROCESS_VIDEOS] Concatenation %s submitted to Shotstack (render ID: %s).", concatenated_task_id, render_id)
+    except Exception as e:
+        logger.exception("[PROCESS_VIDEOS] Shotstack concatenation failed for %s:", concatenated_task_id)
+        updates = {"status": 'concatenated_failed', "message": f"Shotstack render could not be initiated: {e}"}
+
+    try:
+        db_service.update_task_fields(concatenated_task_id, updates)
+        _invalidate_tasks(concatenated_task_id)
+    except Exception:
+        logger.exception("[PROCESS_VIDEOS] Failed to store concatenation state for %s:", concatenated_task_id)
+
 @app.route('/process_videos', methods=['POST'])
+@limiter.limit("10/minute")
 def process_videos():
     """
     Processes a batch of videos. It can either initiate individual renders for all of them
@@ -318,13 +788,16 @@ def process_videos():
             return jsonify({"error": "No task IDs provided"}), 400
 
         # --- Validate and collect tasks ---
-        valid_tasks_dicts = []
-        for tid in task_ids:
-            task_dict = db_service.get_task_by_id(tid)
-            if task_dict and task_dict.get('cloudinaryUrl') and task_dict.get('status') == 'completed':
-                valid_tasks_dicts.append(task_dict)
-            else:
-                logger.warning(f"[PROCESS_VIDEOS] Skipping task {tid}: not found or status not 'completed'.")
+        # One IN query for all ids instead of a SELECT per task
+        tasks_map = db_service.get_tasks_by_ids(task_ids)
+        valid_tasks_dicts = [
+            t for tid in task_ids
+            if (t := tasks_map.get(tid)) and t.get('cloudinaryUrl') and t.get('status') == 'completed'
+        ]
+        if len(valid_tasks_dicts) < len(task_ids):
+            valid_ids = {t['taskId'] for t in valid_tasks_dicts}
+            skipped_ids = [tid for tid in task_ids if tid not in valid_ids]
+            logger.warning("[PROCESS_VIDEOS] Skipping tasks %s: not found or status not 'completed'.", skipped_ids)
 
         if not valid_tasks_dicts:
             return jsonify({"error": "No valid tasks found for processing."}), 404
@@ -334,45 +807,112 @@ def process_videos():
             if len(valid_tasks_dicts) < 2:
                 return jsonify({"error": "At least two videos are required to concatenate."}), 400
             
-            logger.info(f"Initiating concatenation for {len(valid_tasks_dicts)} videos.")
-            
+            source_task_ids = [t['taskId'] for t in valid_tasks_dicts]
+            # The same videos in the same order always map to the same concatenated task,
+            # so a repeated request reuses the existing render instead of starting a new one
+            # Fed incrementally with a \0 separator, so ["a", "bc"] and ["ab", "c"] never collide
+            concat_hash = hashlib.sha256(b"concatenated")
+            for source_task_id in source_task_ids:
+                concat_hash.update(b"\0" + source_task_id.encode())
+            # Hex-encode only the 10 bytes we keep (20 hex chars, same id as hexdigest()[:20])
+            concat_digest = concat_hash.digest()[:10].hex()
+            concatenated_task_id = f"concatenated_video_{concat_digest}"
+
             cloudinary_video_urls = [t.get('cloudinaryUrl') for t in valid_tasks_dicts]
             all_tasks_metadata = [t.get('videoMetadata') for t in valid_tasks_dicts]
-            
-            render_id, _ = shotstack_service.initiate_shotstack_render(
-                cloudinary_video_url_or_urls=cloudinary_video_urls,
-                video_metadata=all_tasks_metadata,
-                connect_videos=True,
-                instagram_username=data.get('instagram_username'),
-                email=data.get('email'),
-                linkedin_profile=data.get('linkedin_profile')
-            )
-            
-            concatenated_task_id = f"concatenated_video_{render_id}"
-            db_service.add_task({
+
+            # Create the task, or take over a failed (or stuck) concatenation of the same videos,
+            # in one statement: of two concurrent identical requests only one submits a render.
+            # The render id is filled in by the background job once Shotstack accepts the render.
+            claimed_task = db_service.claim_concatenation_task({
                 "task_id": concatenated_task_id,
                 "status": 'concatenated_pending',
-                "shotstackRenderId": render_id,
-                "video_metadata": {"source_tasks": task_ids},
+                "shotstackRenderId": None,
+                "message": "Submitting render to Shotstack.",
+                "video_metadata": {"source_tasks": source_task_ids},
                 "instagram_username": data.get('instagram_username'),
                 "email": data.get('email'),
                 "linkedin_profile": data.get('linkedin_profile')
-            })
+            }, CONCAT_SUBMIT_GRACE_PERIOD)
+
+            if claimed_task is None:
+                existing_task = db_service.get_task_by_id(concatenated_task_id) or {}
+                logger.info("Concatenation %s already exists (status: %s), reusing it.", concatenated_task_id, existing_task.get('status'))
+                return jsonify({
+                    "message": "Video concatenation already initiated.",
+                    "concatenatedTaskId": concatenated_task_id,
+                    "shotstackRenderId": existing_task.get('shotstackRenderId')
+                }), 200
+
+            logger.info("Initiating concatenation for %s videos.", len(valid_tasks_dicts))
+            _invalidate_tasks(concatenated_task_id)
+
+            _SHOTSTACK_POOL.submit(
+                _concatenate_in_background, concatenated_task_id, cloudinary_video_urls, all_tasks_metadata,
+                data.get('instagram_username'), data.get('email'), data.get('linkedin_profile')
+            )
             
+            # The frontend polls /task-status/<concatenatedTaskId> for the render id and result
             return jsonify({
                 "message": "Video concatenation initiated.",
                 "concatenatedTaskId": concatenated_task_id,
-                "shotstackRenderId": render_id
-            }), 200
+                "shotstackRenderId": None
+            }), 202
         
         # --- Individual Processing Logic (If not concatenating) ---
         else:
-            # This part can be implemented if needed, following the same pattern
-            logger.warning("Individual processing for multiple videos is not yet fully implemented.")
-            return jsonify({"message": "Individual processing not implemented"}), 501
+            logger.info("Initiating individual renders for %s videos.", len(valid_tasks_dicts))
+
+            # Shotstack calls are independent, so send them all at once: ~1 RTT instead of N
+            futures = {
+                _SHOTSTACK_POOL.submit(
+                    shotstack_service.initiate_shotstack_render,
+                    cloudinary_video_url_or_urls=t.get('cloudinaryUrl'),
+                    video_metadata=t.get('videoMetadata') or {},
+                    original_filename=t.get('originalFilename'),
+                    instagram_username=t.get('instagramUsername'),
+                    email=t.get('email'),
+                    linkedin_profile=t.get('linkedinProfile'),
+                    connect_videos=False
+                ): t.get('taskId')
+                for t in valid_tasks_dicts
+            }
+
+            results = []
+            pending_updates = []
+            for future in as_completed(futures):
+                task_id = futures[future]
+                try:
+                    render_id, _ = future.result()
+                except Exception as e:
+                    # One failed render must not abort the others
+                    logger.error("[PROCESS_VIDEOS] Shotstack render failed for task %s: %s", task_id, e)
+                    results.append({"taskId": task_id, "error": str(e)})
+                    continue
+
+                pending_updates.append({
+                    "task_id": task_id,
+                    "status": 'shotstack_pending',
+                    "message": f"Shotstack render initiated with ID: {render_id}",
+                    "shotstackRenderId": render_id
+                })
+                results.append({"taskId": task_id, "shotstackRenderId": render_id})
+
+            # All successful renders are stored with one transaction instead of a commit per task
+            if pending_updates:
+                db_service.bulk_update_tasks(pending_updates)
+                _invalidate_tasks(*(u['task_id'] for u in pending_updates))
+
+            if not pending_updates:
+                return jsonify({"error": "No Shotstack renders could be initiated.", "results": results}), 502
+
+            return jsonify({
+                "message": "Individual renders initiated.",
+                "results": results
+            }), 200
 
     except Exception as e:
-        logger.exception(f"[PROCESS_VIDEOS] An unexpected error occurred:")
+        logger.exception("[PROCESS_VIDEOS] An unexpected error occurred:")
         return jsonify({"error": "An unexpected server error occurred.", "details": str(e)}), 500
 
 
@@ -397,34 +937,55 @@ def get_user_videos():
         if not any([instagram_username, email, linkedin_profile]):
             return jsonify({"error": "Please provide an identifier"}), 400
         
-        tasks_from_db = db_service.get_user_videos(
+        # Verification only needs identifiers, so video_metadata isn't loaded for rows about to be deleted
+        task_refs = db_service.get_user_video_refs(
             instagram_username=instagram_username,
             email=email,
             linkedin_profile=linkedin_profile
         )
 
-        verified_tasks = []
+        verified_task_ids = []
         tasks_to_delete_ids = []
 
-        for task_dict in tasks_from_db:
-            public_id = task_dict.get('cloudinaryPublicId')
-            
-            if cloudinary_service.check_video_existence(public_id):
-                verified_tasks.append(task_dict)
+        # Direct uploads get their public_id from /sign-upload before the browser has finished
+        # sending the file, so a recent 'uploading' task isn't missing from Cloudinary - it just
+        # isn't there yet. Past the grace period it is verified (and cleaned up) like any other.
+        in_flight_task_ids = {
+            task_id for task_id, _, status, created_at in task_refs
+            if status == 'uploading' and _is_upload_in_grace_period(created_at)
+        }
+
+        # Check all videos against Cloudinary in batched requests (usually a single call)
+        existing_public_ids = cloudinary_service.check_videos_existence(
+            [public_id for task_id, public_id, _, _ in task_refs if public_id and task_id not in in_flight_task_ids]
+        )
+
+        for task_id, public_id, status, _ in task_refs:
+            # An 'uploading' task without a public_id past the grace period lost its background
+            # upload to a worker restart: nothing will ever fill it in, so it's an orphan
+            if not public_id and status == 'uploading' and task_id not in in_flight_task_ids:
+                logger.warning("Upload for task %s never completed. Marking for deletion.", task_id)
+                tasks_to_delete_ids.append(task_id)
+            # Tasks without a Cloudinary asset yet (concatenations) can't be checked
+            elif not public_id or task_id in in_flight_task_ids or public_id in existing_public_ids:
+                verified_task_ids.append(task_id)
             else:
-                logger.warning(f"Video for task {task_dict.get('taskId')} (public_id: {public_id}) not found in Cloudinary. Marking for deletion.")
-                tasks_to_delete_ids.append(task_dict.get('id'))
+                logger.warning("Video for task %s (public_id: %s) not found in Cloudinary. Marking for deletion.", task_id, public_id)
+                tasks_to_delete_ids.append(task_id)
 
         if tasks_to_delete_ids:
-            logger.info(f"Deleting {len(tasks_to_delete_ids)} orphaned records from DB...")
-            for task_primary_key in tasks_to_delete_ids:
-                if task_primary_key:
-                    db_service.delete_task_by_id(task_primary_key)
+            logger.info("Deleting %s orphaned records from DB...", len(tasks_to_delete_ids))
+            db_service.delete_tasks_by_ids(tasks_to_delete_ids)
+            _invalidate_tasks(*tasks_to_delete_ids)
+
+        # Full rows only for the surviving videos, kept in newest-first order
+        tasks_map = db_service.get_tasks_by_ids(verified_task_ids)
+        verified_tasks = [tasks_map[task_id] for task_id in verified_task_ids if task_id in tasks_map]
 
         return jsonify(verified_tasks), 200
 
     except Exception as e:
-        logger.error(f"[USER_VIDEOS] Error during video fetch and verification: {e}", exc_info=True)
+        logger.error("[USER_VIDEOS] Error during video fetch and verification: %s", e, exc_info=True)
         return jsonify({"error": "An unexpected server error occurred"}), 500
 
 if __name__ == '__main__':
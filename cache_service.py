@@ -0,0 +1,128 @@
+# cache_service.py
+"""
+Optional Redis cache that sits in front of the database.
+The cache is enabled only when the REDIS_URL environment variable is set; without it
+every read is a miss and every write is a no-op, so the app behaves exactly as before.
+Redis errors are logged and treated as cache misses - the database stays the source of truth.
+"""
+
+import os
+import logging
+import orjson
+import redis
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.environ.get('REDIS_URL')
+TASK_TTL_SECONDS = 3600
+GEOCODE_TTL_SECONDS = 30 * 86400
+
+_client = None
+if REDIS_URL:
+    _client = redis.Redis(connection_pool=redis.ConnectionPool.from_url(REDIS_URL, max_connections=50))
+
+
+def _task_key(task_id):
+    """Builds the Redis key for a task."""
+    return f"task:{task_id}"
+
+
+def get_task_json(task_id):
+    """
+    Returns the cached task as serialized JSON.
+
+    Args:
+        task_id (str): The unique task identifier string.
+
+    Returns:
+        bytes or None: The JSON document, or None on a miss (or if the cache is disabled).
+    """
+    if _client is None:
+        return None
+    try:
+        return _client.get(_task_key(task_id))
+    except redis.RedisError as e:
+        logger.warning("[CacheService] Redis GET failed for task '%s': %s", task_id, e)
+        return None
+
+
+def get_tasks_json(task_ids):
+    """
+    Returns the cached tasks as serialized JSON in a single MGET round-trip.
+
+    Args:
+        task_ids (list[str]): Task identifiers.
+
+    Returns:
+        list: JSON documents (bytes) or None for misses, in the same order as task_ids.
+    """
+    if _client is None or not task_ids:
+        return [None] * len(task_ids)
+    try:
+        return _client.mget([_task_key(task_id) for task_id in task_ids])
+    except redis.RedisError as e:
+        logger.warning("[CacheService] Redis MGET failed for %s tasks: %s", len(task_ids), e)
+        return [None] * len(task_ids)
+
+
+def set_task(task_id, task_dict):
+    """
+    Stores a task dictionary as JSON with a TTL.
+
+    Args:
+        task_id (str): The unique task identifier string.
+        task_dict (dict): The camelCase task dictionary returned to the frontend.
+    """
+    if _client is None:
+        return
+    try:
+        _client.setex(_task_key(task_id), TASK_TTL_SECONDS, orjson.dumps(task_dict, option=orjson.OPT_NAIVE_UTC))
+    except redis.RedisError as e:
+        logger.warning("[CacheService] Redis SETEX failed for task '%s': %s", task_id, e)
+
+
+def invalidate_tasks(*task_ids):
+    """
+    Drops cached entries for the given tasks. Must be called whenever a task row changes.
+
+    Args:
+        *task_ids (str): Task identifiers whose cache entries should be removed.
+    """
+    if _client is None or not task_ids:
+        return
+    try:
+        _client.delete(*(_task_key(task_id) for task_id in task_ids))
+    except redis.RedisError as e:
+        logger.warning("[CacheService] Redis DEL failed for tasks %s: %s", task_ids, e)
+
+
+def _geocode_key(lat, lon):
+    """Builds the Redis key for a reverse-geocoding result (~110 m precision)."""
+    return f"geo:{round(float(lat), 3)}:{round(float(lon), 3)}"
+
+
+def get_geocode(lat, lon):
+    """
+    Returns a cached reverse-geocoding address for the given coordinates.
+
+    Returns:
+        str or None: The address, or None on a miss (or if the cache is disabled).
+    """
+    if _client is None:
+        return None
+    try:
+        address = _client.get(_geocode_key(lat, lon))
+    except redis.RedisError as e:
+        logger.warning("[CacheService] Redis GET failed for geocode (%s, %s): %s", lat, lon, e)
+        return None
+    return address.decode() if address is not None else None
+
+
+def set_geocode(lat, lon, address):
+    """Stores a reverse-geocoding address for the given coordinates with a TTL."""
+    if _client is None:
+        return
+    try:
+        _client.setex(_geocode_key(lat, lon), GEOCODE_TTL_SECONDS, address)
+    except redis.RedisError as e:
+        logger.warning("[CacheService] Redis SETEX failed for geocode (%s, %s): %s", lat, lon, e)
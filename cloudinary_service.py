@@ -1,14 +1,98 @@
 # cloudinary_service.py
 import cloudinary
+import cloudinary.api
 import cloudinary.uploader
-import hashlib
-from datetime import datetime
+import cloudinary.utils
 import logging
 import os
-from cloudinary.exceptions import NotFound
+import re
+import secrets
+import threading
+import time
+from cloudinary.exceptions import RateLimited
 
 logger = logging.getLogger(__name__)
 
+# Всё, кроме букв, цифр, '_' и '-', вырезается из имени пользователя одним проходом на уровне C.
+# \w (а не A-Za-z0-9) сохраняет прежнее поведение str.isalnum() для не-ASCII имён.
+_USERNAME_STRIP_RE = re.compile(r"[^\w\-]")
+
+# Ограничивает число одновременных загрузок в Cloudinary на процесс, чтобы всплеск загрузок
+# не занял все потоки воркера и не перегрузил Cloudinary (остальные запросы ждут своей очереди).
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "4"))
+_upload_sem = threading.BoundedSemaphore(UPLOAD_CONCURRENCY)
+
+# Максимум public_id в одном вызове resources_by_ids (ограничение Admin API)
+RESOURCES_BY_IDS_BATCH_SIZE = 100
+
+# Admin API Cloudinary ограничен по частоте запросов: не больше ADMIN_API_CONCURRENCY одновременных
+# вызовов на процесс, а при 429 (RateLimited) - повтор с экспоненциальной задержкой 1, 2, 4 с.
+ADMIN_API_CONCURRENCY = int(os.environ.get("CLOUDINARY_ADMIN_API_CONCURRENCY", "8"))
+ADMIN_API_MAX_RETRIES = 3
+_admin_api_sem = threading.BoundedSemaphore(ADMIN_API_CONCURRENCY)
+
+# Поля ответа Cloudinary, которые реально используются приложением (Shotstack, фронтенд);
+# остальное (eager, context, playback_url и т.д.) в video_metadata не сохраняется
+VIDEO_METADATA_KEYS = ("duration", "width", "height", "bytes", "format", "public_id", "secure_url", "resource_type", "created_at")
+
+# Размер куска для chunked-загрузки (Cloudinary требует минимум 5 МБ)
+UPLOAD_CHUNK_SIZE = 6_000_000
+
+def project_video_metadata(upload_result):
+    """
+    Оставляет из ответа (или уведомления) Cloudinary только поля VIDEO_METADATA_KEYS.
+    Отсутствующие в ответе поля не добавляются (а не сохраняются как None), поэтому
+    значения по умолчанию в .get(key, default) в shotstack_service продолжают работать.
+
+    Args:
+        upload_result (dict): Ответ Cloudinary о загрузке.
+
+    Returns:
+        dict: Компактные метаданные для сохранения в video_metadata.
+    """
+    return {key: upload_result[key] for key in VIDEO_METADATA_KEYS if key in upload_result}
+
+def _call_admin_api(method, *args, **kwargs):
+    """
+    Вызывает метод Admin API (например, cloudinary.api.resources_by_ids) под семафором
+    и повторяет его с экспоненциальной задержкой, если Cloudinary ответил RateLimited.
+    Семафор на время ожидания освобождается, чтобы не блокировать другие вызовы.
+
+    Raises:
+        RateLimited: Если лимит не освободился после ADMIN_API_MAX_RETRIES повторов.
+    """
+    for attempt in range(ADMIN_API_MAX_RETRIES + 1):
+        try:
+            with _admin_api_sem:
+                return method(*args, **kwargs)
+        except RateLimited:
+            if attempt == ADMIN_API_MAX_RETRIES:
+                raise
+            delay = 2 ** attempt
+            logger.warning("[CloudinaryService] Admin API: превышен лимит запросов, повтор через %s с.", delay)
+            time.sleep(delay)
+
+def _build_public_id(original_filename, instagram_username):
+    """
+    Строит уникальный public_id вида hife_video_analysis/<username>/<имя файла>_<суффикс>.
+
+    Returns:
+        tuple: (cleaned_username, public_id)
+    """
+    # Очищаем имя пользователя Instagram для использования в путях и тегах Cloudinary
+    cleaned_username = _USERNAME_STRIP_RE.sub("", instagram_username or '')
+    if not cleaned_username:
+        cleaned_username = "anonymous" # Запасной вариант, если имя пользователя пустое
+
+    original_filename_base = os.path.splitext(original_filename)[0]
+    # Случайный суффикс (8 hex-символов) делает public_id уникальным; в отличие от MD5 от времени,
+    # он не совпадает у двух одновременных загрузок одного и того же файла.
+    unique_suffix = secrets.token_hex(4)
+
+    # Public ID для Cloudinary будет включать имя пользователя и уникальный суффикс
+    # Это помогает предотвратить коллизии имен и организовать ресурсы.
+    return cleaned_username, f"hife_video_analysis/{cleaned_username}/{original_filename_base}_{unique_suffix}"
+
 def upload_video_to_cloudinary(file_stream, original_filename, instagram_username):
     """
     Загружает видеофайл в Cloudinary.
@@ -16,7 +100,7 @@ def upload_video_to_cloudinary(file_stream, original_filename, instagram_usernam
     установлена до вызова этой функции (например, в app.py).
 
     Args:
-        file_stream: Объект файла (например, request.files['video']).
+        file_stream: Файловый поток (например, request.files['video'].stream); читается кусками.
         original_filename (str): Оригинальное имя файла.
         instagram_username (str): Имя пользователя Instagram для организации папок.
 
@@ -27,33 +111,27 @@ def upload_video_to_cloudinary(file_stream, original_filename, instagram_usernam
     Raises:
         Exception: Если загрузка в Cloudinary не удалась или отсутствует secure_url.
     """
-    # Очищаем имя пользователя Instagram для использования в путях и тегах Cloudinary
-    cleaned_username = "".join(c for c in (instagram_username or '').strip() if c.isalnum() or c in ('_', '-')).strip()
-    if not cleaned_username:
-        cleaned_username = "anonymous" # Запасной вариант, если имя пользователя пустое
-
-    original_filename_base = os.path.splitext(original_filename)[0]
-    # Используем уникальный хэш для создания уникального public_id
-    unique_hash = hashlib.md5(f"{cleaned_username}/{original_filename}/{datetime.now().timestamp()}".encode()).hexdigest()
-    
-    # Public ID для Cloudinary будет включать имя пользователя и часть уникального хэша
-    # Это помогает предотвратить коллизии имен и организовать ресурсы.
-    public_id = f"hife_video_analysis/{cleaned_username}/{original_filename_base}_{unique_hash[:8]}"
+    cleaned_username, public_id = _build_public_id(original_filename, instagram_username)
 
-    logger.info(f"[CloudinaryService] Загрузка видео '{original_filename}' в Cloudinary (public_id: {public_id})...")
+    logger.info("[CloudinaryService] Загрузка видео '%s' в Cloudinary (public_id: %s)...", original_filename, public_id)
     try:
-        upload_result = cloudinary.uploader.upload(
-            file_stream,
-            resource_type="video",
-            folder=f"hife_video_analysis/{cleaned_username}", # Папка для организации в Cloudinary
-            public_id=public_id,
-            unique_filename=False, # public_id уже уникален благодаря хэшу
-            overwrite=True, # Перезаписать, если ресурс с таким public_id уже существует (крайне маловероятно)
-            quality="auto", # Автоматическая оптимизация качества
-            format="mp4",   # Конвертация в MP4
-            tags=["hife_analysis", cleaned_username] # Добавление тегов для лучшей организации
-        )
-        logger.info(f"[CloudinaryService] Ответ Cloudinary: {upload_result.keys()}")
+        with _upload_sem:
+            # upload_large читает поток кусками по UPLOAD_CHUNK_SIZE и отправляет их по очереди,
+            # поэтому в памяти одновременно находится один кусок, а не весь файл.
+            upload_result = cloudinary.uploader.upload_large(
+                file_stream,
+                chunk_size=UPLOAD_CHUNK_SIZE,
+                filename=original_filename,
+                resource_type="video",
+                folder=f"hife_video_analysis/{cleaned_username}", # Папка для организации в Cloudinary
+                public_id=public_id,
+                unique_filename=False, # public_id уже уникален благодаря суффиксу
+                overwrite=True, # Перезаписать, если ресурс с таким public_id уже существует (крайне маловероятно)
+                quality="auto", # Автоматическая оптимизация качества
+                format="mp4",   # Конвертация в MP4
+                tags=["hife_analysis", cleaned_username] # Добавление тегов для лучшей организации
+            )
+        logger.info("[CloudinaryService] Ответ Cloudinary: %s", upload_result.keys())
 
         if upload_result and upload_result.get('secure_url'):
             # Проверка, что основные метаданные доступны и корректны
@@ -62,8 +140,8 @@ def upload_video_to_cloudinary(file_stream, original_filename, instagram_usernam
                upload_result.get('height', 0) <= 0 or \
                upload_result.get('bytes', 0) <= 0:
                 logger.warning(
-                    f"[CloudinaryService] ПРЕДУПРЕЖДЕНИЕ: Видео загружено, но основные метаданные "
-                    f"(duration/resolution/size) отсутствуют или равны 0. Полные метаданные: {upload_result}"
+                    "[CloudinaryService] ПРЕДУПРЕЖДЕНИЕ: Видео загружено, но основные метаданные "
+                    "(duration/resolution/size) отсутствуют или равны 0. Полные метаданные: %s", upload_result
                 )
                 # Возвращаем результат даже с неполными метаданными, пусть app.py решает, что делать дальше.
             return upload_result
@@ -72,30 +150,75 @@ def upload_video_to_cloudinary(file_stream, original_filename, instagram_usernam
             raise Exception(f"Загрузка в Cloudinary не удалась: secure_url отсутствует в ответе. Ответ: {upload_result}")
 
     except Exception as e:
-        logger.error(f"[CloudinaryService] ОШИБКА при загрузке в Cloudinary: {e}", exc_info=True)
+        logger.error("[CloudinaryService] ОШИБКА при загрузке в Cloudinary: %s", e, exc_info=True)
         raise # Перебрасываем исключение для обработки в app.py
 
-def check_video_existence(public_id):
+def sign_direct_upload(original_filename, instagram_username, notification_url=None):
     """
-    Проверяет, существует ли ресурс в Cloudinary.
-    Возвращает True, если ресурс найден, и False, если нет.
+    Подписывает параметры для прямой загрузки видео из браузера в Cloudinary.
+    Файл идёт напрямую в api.cloudinary.com, а бэкенд только подписывает небольшой набор
+    параметров (api_secret при этом не покидает сервер).
+
+    Args:
+        original_filename (str): Оригинальное имя файла.
+        instagram_username (str): Имя пользователя Instagram для организации папок.
+        notification_url (str, optional): URL вебхука, который Cloudinary вызовет после загрузки.
+
+    Returns:
+        dict: Параметры для POST-запроса на 'upload_url' (public_id, tags, timestamp,
+              notification_url, signature, api_key) плюс сам 'upload_url'.
     """
-    if not public_id:
-        return False
-    try:
-        # Метод .resource() вернет данные, если ресурс есть,
-        # или выбросит исключение NotFound, если его нет.
-        cloudinary.api.resource(public_id, resource_type="video")
-        logger.info(f"[CloudinaryService] Проверка: ресурс '{public_id}' существует.")
-        return True
-    except NotFound:
-        # Это ожидаемое исключение, если файла нет.
-        logger.warning(f"[CloudinaryService] Проверка: ресурс '{public_id}' НЕ НАЙДЕН в Cloudinary.")
-        return False
-    except Exception as e:
-        # Любые другие ошибки (проблемы с API, соединением) логируем.
-        logger.error(f"[CloudinaryService] Ошибка при проверке ресурса '{public_id}': {e}")
-        # В этом случае лучше считать, что ресурс есть, чтобы случайно не удалить его.
-        return True
+    cleaned_username, public_id = _build_public_id(original_filename, instagram_username)
+    params = {
+        "timestamp": int(time.time()),
+        "public_id": public_id,
+        "tags": f"hife_analysis,{cleaned_username}",
+    }
+    if notification_url:
+        params["notification_url"] = notification_url
+
+    config = cloudinary.config()
+    params["signature"] = cloudinary.utils.api_sign_request(params, config.api_secret)
+    params["api_key"] = config.api_key
+    params["upload_url"] = f"https://api.cloudinary.com/v1_1/{config.cloud_name}/video/upload"
+    logger.info("[CloudinaryService] Подписана прямая загрузка '%s' (public_id: %s).", original_filename, public_id)
+    return params
+
+def verify_notification(body, timestamp, signature):
+    """
+    Проверяет подпись уведомления (вебхука) от Cloudinary.
+
+    Args:
+        body (str): Тело запроса без изменений.
+        timestamp (int): Значение заголовка X-Cld-Timestamp.
+        signature (str): Значение заголовка X-Cld-Signature.
+
+    Returns:
+        bool: True, если подпись верна и уведомление не устарело.
+    """
+    return cloudinary.utils.verify_notification_signature(body, timestamp, signature)
 
+def check_videos_existence(public_ids):
+    """
+    Проверяет существование нескольких ресурсов в Cloudinary пакетно:
+    один вызов resources_by_ids на каждые RESOURCES_BY_IDS_BATCH_SIZE id (обычно один запрос на пользователя).
 
+    Args:
+        public_ids (list[str]): Список public_id для проверки.
+
+    Returns:
+        set[str]: public_id, которые существуют (или не удалось проверить из-за ошибки API).
+    """
+    found = set()
+    for start in range(0, len(public_ids), RESOURCES_BY_IDS_BATCH_SIZE):
+        batch = public_ids[start:start + RESOURCES_BY_IDS_BATCH_SIZE]
+        try:
+            result = _call_admin_api(
+                cloudinary.api.resources_by_ids, batch, resource_type="video", fields="public_id", max_results=RESOURCES_BY_IDS_BATCH_SIZE
+            )
+            found.update(resource['public_id'] for resource in result.get('resources', []))
+        except Exception as e:
+            # При ошибке API считаем, что ресурсы есть, чтобы случайно не удалить их.
+            logger.error("[CloudinaryService] Ошибка при пакетной проверке %s ресурсов: %s", len(batch), e)
+            found.update(batch)
+    return found
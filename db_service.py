@@ -6,15 +6,28 @@ and provides helper functions for all CRUD (Create, Read, Update, Delete) operat
 """
 
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, JSON, or_, Index
-from sqlalchemy.orm import sessionmaker, declarative_base
+import orjson
+from sqlalchemy import create_engine, Column, String, Text, DateTime, JSON, or_, and_, Index, text, select, func, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
+from sqlalchemy.dialects.postgresql import insert as pg_insert, JSONB
 from sqlalchemy.exc import SQLAlchemyError
-from datetime import datetime, timezone
 import logging
 from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
 
+# Under gunicorn's gevent worker the sockets are monkey-patched, but psycopg2 talks to
+# Postgres through libpq in C. psycogreen installs a wait callback so DB calls yield to
+# other greenlets instead of blocking the whole worker.
+try:
+    from gevent import monkey
+    if monkey.is_module_patched('socket'):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+except ImportError:
+    pass
+
 # --- Database Configuration ---
 DATABASE_URL = os.environ.get('DATABASE_URL')
 if not DATABASE_URL:
@@ -25,9 +38,52 @@ engine_args = {}
 if DATABASE_URL.startswith("postgresql") and "sslmode=" not in DATABASE_URL:
     engine_args['connect_args'] = {'sslmode': 'require'}
 
+# Server-side cap on query time, so a slow query can't pin a pooled connection.
+# PgBouncer rejects the startup 'options' parameter, so it's only sent on direct connections.
+STATEMENT_TIMEOUT_MS = int(os.environ.get('STATEMENT_TIMEOUT_MS', '5000'))
+if DATABASE_URL.startswith("postgresql") and STATEMENT_TIMEOUT_MS > 0 and os.environ.get('USE_PGBOUNCER') != '1':
+    engine_args.setdefault('connect_args', {})['options'] = f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"
+
+# psycopg2 fast execution helpers: multi-row INSERTs are sent as paged VALUES lists
+# and other executemany() calls (bulk UPDATEs) are batched with execute_batch.
+if make_url(DATABASE_URL).get_dialect().driver == 'psycopg2':
+    engine_args.update(
+        executemany_mode='values_plus_batch',
+        insertmanyvalues_page_size=1000,
+        executemany_batch_page_size=500
+    )
+
+# Use orjson for the JSON column (video_metadata) as well
+engine_args['json_serializer'] = lambda obj: orjson.dumps(obj).decode()
+engine_args['json_deserializer'] = orjson.loads
+
+# Connection pool sizing: enough connections for all worker threads, with stale
+# connections (dropped by Render's proxy) recycled instead of failing at query time.
+# LIFO checkout keeps reusing the most recently used (warm) connections, so idle ones
+# at the bottom of the pool are the ones that age out.
+# Only for Postgres: a local sqlite URL may get a pool class that rejects QueuePool arguments.
+if DATABASE_URL.startswith("postgresql"):
+    engine_args.update(pool_size=10, max_overflow=20, pool_timeout=30, pool_use_lifo=True)
+    if os.environ.get('USE_PGBOUNCER') == '1':
+        # PgBouncer in transaction mode manages server connections itself; a pre-ping would
+        # cost an extra round-trip per checkout, so just recycle client connections quickly.
+        engine_args.update(pool_pre_ping=False, pool_recycle=60)
+    else:
+        engine_args.update(pool_pre_ping=True, pool_recycle=300)
+
+# TCP keepalives stop Render's proxy from silently dropping idle connections,
+# so the pre-ping rarely has to reconnect.
+if DATABASE_URL.startswith("postgresql"):
+    engine_args.setdefault('connect_args', {}).update(keepalives=1, keepalives_idle=30)
+
 engine = create_engine(DATABASE_URL, **engine_args)
 Base = declarative_base()
-Session = sessionmaker(bind=engine)
+# expire_on_commit=False keeps attributes loaded after commit, so reading them later
+# (e.g. on objects returned from session_scope) doesn't trigger another SELECT.
+# autoflush=False: the service functions commit explicitly, so queries don't need an implicit flush.
+# scoped_session hands out one session per thread (greenlet under gevent); app.py removes it
+# at the end of each request.
+Session = scoped_session(sessionmaker(bind=engine, expire_on_commit=False, autoflush=False))
 
 
 # --- Helper Function ---
@@ -40,14 +96,33 @@ def to_camel_case(snake_str):
     return components[0] + ''.join(x.title() for x in components[1:])
 
 
+def row_to_dict(row):
+    """
+    Converts a snake_case mapping of Task columns (e.g. a RETURNING row)
+    into the camelCase dictionary used for API responses, in a single pass.
+    The 'timestamp' datetime is left as is; orjson serializes it to ISO 8601.
+    """
+    return {TASK_API_KEYS[key]: value for key, value in row.items()}
+
+
 # --- Data Model (Schema) ---
 class Task(Base):
     """SQLAlchemy model representing a video processing task."""
     __tablename__ = 'tasks'
+    __table_args__ = (
+        # Listing tasks by status, newest first (e.g. pending renders) without a sequential scan
+        Index('ix_tasks_status_timestamp', 'status', 'timestamp'),
+    )
+    # Fetch the server-generated timestamps with RETURNING instead of a follow-up SELECT
+    __mapper_args__ = {'eager_defaults': True}
 
     # Columns
-    id = Column(Integer, primary_key=True)
-    task_id = Column(String, unique=True, nullable=False, index=True)
+    # NOTE: task_id is the primary key (the old auto-increment `id` column was dropped).
+    # Migration for existing databases:
+    #   ALTER TABLE tasks DROP CONSTRAINT tasks_pkey;
+    #   ALTER TABLE tasks DROP COLUMN id;
+    #   ALTER TABLE tasks ADD PRIMARY KEY (task_id);
+    task_id = Column(String, primary_key=True)
     cloudinary_public_id = Column(String, unique=True, index=True)
     instagram_username = Column(String, index=True)
     email = Column(String, index=True)
@@ -55,31 +130,30 @@ class Task(Base):
     original_filename = Column(String)
     status = Column(String)
     cloudinary_url = Column(String)
-    video_metadata = Column(JSON)
+    # Stored as JSONB on Postgres (parsed once on write, not on every read).
+    # Migration for existing databases:
+    #   ALTER TABLE tasks ALTER COLUMN video_metadata TYPE jsonb USING video_metadata::jsonb;
+    video_metadata = Column(JSON().with_variant(JSONB(), 'postgresql'))
     message = Column(Text)
-    timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    # timestamptz, so the UTC offset round-trips. Migration for existing databases:
+    #   ALTER TABLE tasks ALTER COLUMN timestamp TYPE timestamptz USING timestamp AT TIME ZONE 'UTC';
+    # Last-modified time: filled in and bumped on every UPDATE by the database, not by Python.
+    # The server default is set on existing databases by ensure_columns().
+    timestamp = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    # Creation time, never updated; user video lists are ordered by it.
+    # Added to existing databases (and backfilled from timestamp) by ensure_columns().
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
     shotstackRenderId = Column(String)
     shotstackUrl = Column(String)
     posterUrl = Column(String)
 
     def __repr__(self):
         """String representation of the Task object for debugging."""
-        return f"<Task(id={self.id}, task_id='{self.task_id}', status='{self.status}')>"
-
-    def to_dict(self):
-        """
-        Automatically creates a dictionary from the model's fields
-        and converts its keys to camelCase for API responses.
-        """
-        # 1. Automatically get a dict with snake_case keys from all table columns
-        snake_case_dict = {c.name: getattr(self, c.name) for c in self.__table__.columns}
-        
-        # 2. Convert datetime object to ISO 8601 string format if it exists
-        if isinstance(snake_case_dict.get('timestamp'), datetime):
-            snake_case_dict['timestamp'] = snake_case_dict['timestamp'].isoformat()
-            
-        # 3. Create a new dictionary, converting each key to camelCase
-        return {to_camel_case(key): value for key, value in snake_case_dict.items()}
+        return f"<Task(task_id='{self.task_id}', status='{self.status}')>"
+
+
+# Column name -> camelCase API key for every Task column, computed once at import
+TASK_API_KEYS = {c.name: to_camel_case(c.name) for c in Task.__table__.columns}
 
 
 # --- Session Management ---
@@ -88,6 +162,8 @@ def session_scope():
     """
     Provide a transactional scope around a series of operations.
     This handles session creation, commit, rollback, and closing.
+    The thread-local session is removed from the scoped_session registry on exit,
+    so long-lived executor threads don't keep a stale session (and its identity map) around.
     """
     session = Session()
     logger.debug("Database session opened.")
@@ -96,33 +172,76 @@ def session_scope():
         session.commit()
         logger.debug("Database session committed.")
     except SQLAlchemyError as e:
-        logger.error(f"Session rollback due to error: {e}", exc_info=True)
+        logger.error("Session rollback due to error: %s", e, exc_info=True)
         session.rollback()
         raise
     finally:
-        session.close()
-        logger.debug("Database session closed.")
+        Session.remove()
+        logger.debug("Database session removed.")
 
 
 # --- Database Service Functions ---
 
-def add_task(task_data):
+def upsert_task(task_data):
     """
-    Adds a new task to the database.
+    Inserts a new task or updates the existing one with the same task_id.
+    Runs as a single INSERT ... ON CONFLICT DO UPDATE ... RETURNING statement, so there is
+    no read-before-write round-trip and no race between two concurrent writes of the same task.
 
     Args:
-        task_data (dict): A dictionary containing data for the new Task.
-    
+        task_data (dict): A dictionary containing data for the Task; must include 'task_id'.
+
+    Returns:
+        dict: The stored task (inserted or merged), converted to a camelCase dictionary.
+    """
+    with session_scope() as session:
+        stmt = pg_insert(Task).values(**task_data)
+        set_ = {key: stmt.excluded[key] for key in task_data if key != 'task_id'}
+        # ON CONFLICT bypasses the column's onupdate, so bump the timestamp explicitly
+        set_.setdefault('timestamp', func.now())
+        stmt = stmt.on_conflict_do_update(index_elements=[Task.task_id], set_=set_).returning(*Task.__table__.columns)
+        row = session.execute(stmt).mappings().one()
+        logger.info("Task '%s' upserted in DB.", row['task_id'])
+        # The RETURNING row already holds the merged state, no second SELECT is needed
+        return row_to_dict(row)
+
+def claim_concatenation_task(task_data, grace_period):
+    """
+    Creates a 'concatenated_pending' task, or takes over an existing one that can be restarted:
+    it failed, or it is still pending without a Shotstack render id after grace_period (its
+    background submit was lost). Runs as a single INSERT ... ON CONFLICT DO UPDATE ... WHERE
+    ... RETURNING, so of two concurrent identical requests only one gets the row back.
+
+    Args:
+        task_data (dict): A dictionary containing data for the Task; must include 'task_id'.
+        grace_period (datetime.timedelta): How long a pending task may wait for its render id.
+
     Returns:
-        dict: The newly created task object, converted to a camelCase dictionary.
+        dict or None: The claimed task as a camelCase dictionary, or None if the existing
+                      task is still live and must be reused instead of submitted again.
     """
     with session_scope() as session:
-        new_task = Task(**task_data)
-        session.add(new_task)
-        session.flush()  # Flush to get the new object with its ID before commit
-        logger.info(f"Task '{new_task.task_id}' added to DB.")
-        # CHANGED: Always return a dictionary to prevent DetachedInstanceError
-        return new_task.to_dict()
+        stmt = pg_insert(Task).values(**task_data)
+        set_ = {key: stmt.excluded[key] for key in task_data if key != 'task_id'}
+        set_['timestamp'] = func.now()
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Task.task_id],
+            set_=set_,
+            # Columns here refer to the row already in the table
+            where=or_(
+                Task.status == 'concatenated_failed',
+                and_(
+                    Task.status == 'concatenated_pending',
+                    Task.shotstackRenderId.is_(None),
+                    Task.timestamp < func.now() - grace_period
+                )
+            )
+        ).returning(*Task.__table__.columns)
+        row = session.execute(stmt).mappings().one_or_none()
+        if row is None:
+            return None
+        logger.info("Concatenation task '%s' claimed in DB.", row['task_id'])
+        return row_to_dict(row)
 
 def get_task_by_id(task_id_str):
     """
@@ -135,9 +254,47 @@ def get_task_by_id(task_id_str):
         dict or None: A camelCase dictionary of the Task if found, otherwise None.
     """
     with session_scope() as session:
-        task = session.query(Task).filter_by(task_id=task_id_str).first()
-        # CHANGED: Return a dictionary or None to prevent DetachedInstanceError
-        return task.to_dict() if task else None
+        # Plain column select: no ORM instance or identity-map bookkeeping for a read-only lookup
+        row = session.execute(
+            select(*Task.__table__.columns).where(Task.task_id == task_id_str)
+        ).mappings().one_or_none()
+        return row_to_dict(row) if row else None
+
+def get_task_status_light(task_id_str):
+    """
+    Retrieves only the status fields of a task (no video_metadata), for cheap polling.
+    shotstackRenderId is included so the caller can tell whether a render is still in flight.
+
+    Args:
+        task_id_str (str): The unique task identifier string.
+
+    Returns:
+        dict or None: {'taskId', 'status', 'message', 'timestamp', 'shotstackRenderId'} or None.
+    """
+    with session_scope() as session:
+        row = session.execute(
+            select(Task.task_id, Task.status, Task.message, Task.timestamp, Task.shotstackRenderId)
+            .where(Task.task_id == task_id_str)
+        ).mappings().one_or_none()
+        return row_to_dict(row) if row else None
+
+def get_tasks_by_ids(task_ids):
+    """
+    Retrieves several tasks with a single WHERE task_id IN (...) query.
+
+    Args:
+        task_ids (list[str]): The task identifier strings.
+
+    Returns:
+        dict: task_id -> camelCase task dictionary, for the tasks that exist.
+    """
+    if not task_ids:
+        return {}
+    with session_scope() as session:
+        rows = session.execute(
+            select(*Task.__table__.columns).where(Task.task_id.in_(task_ids))
+        ).mappings()
+        return {row['task_id']: row_to_dict(row) for row in rows}
 
 def get_task_by_public_id(public_id):
     """
@@ -153,85 +310,173 @@ def get_task_by_public_id(public_id):
     with session_scope() as session:
         return session.query(Task).filter_by(cloudinary_public_id=public_id).first()
 
-def update_task_by_id(task_id_str, updates):
+def update_task_fields(task_id_str, updates):
     """
-    Updates an existing task identified by its string-based task_id.
+    Updates columns of a task with a single UPDATE statement, without loading the row
+    or serializing it back. Use it when the caller already holds the task dictionary.
 
     Args:
         task_id_str (str): The unique task identifier string.
         updates (dict): A dictionary of fields to update.
 
     Returns:
-        dict or None: The updated task as a camelCase dictionary, or None if not found.
+        bool: True if the task was found and updated, False otherwise.
     """
     with session_scope() as session:
-        task = session.query(Task).filter_by(task_id=task_id_str).first()
-        if task:
-            for key, value in updates.items():
-                setattr(task, key, value)
-            logger.info(f"Task '{task.task_id}' updated in DB.")
-            session.flush()
-            # CHANGED: Return the updated dictionary
-            return task.to_dict()
-        return None
+        updated_rows = session.query(Task).filter(Task.task_id == task_id_str).update(updates, synchronize_session=False)
+        logger.info("Task '%s' updated in DB.", task_id_str)
+        return updated_rows > 0
 
-def delete_task_by_id(task_primary_key):
+def bulk_update_tasks(rows):
     """
-    Deletes a task by its integer primary key.
+    Updates several tasks in one transaction. Rows with the same set of keys are sent
+    as a single executemany (batched by psycopg2's execute_batch).
 
     Args:
-        task_primary_key (int): The primary key (id) of the task to delete.
+        rows (list[dict]): Dictionaries of fields to update, each including its 'task_id'.
+    """
+    if not rows:
+        return
+    with session_scope() as session:
+        session.bulk_update_mappings(Task, rows)
+        logger.info("%s tasks updated in DB.", len(rows))
+
+def compact_video_metadata(keep_keys):
+    """
+    One-off migration: strips the stored Cloudinary upload results (rows whose video_metadata
+    has a 'secure_url') down to keep_keys, in a single UPDATE. Rows that are already
+    compact are left untouched.
+
+    Args:
+        keep_keys (Iterable[str]): The video_metadata keys to keep.
+
+    Returns:
+        int: The number of rewritten rows.
+    """
+    with session_scope() as session:
+        # A full-table rewrite can take longer than the per-request statement timeout
+        session.execute(text("SET LOCAL statement_timeout = 0"))
+        result = session.execute(
+            text(
+                "UPDATE tasks SET video_metadata = ("
+                "SELECT jsonb_object_agg(key, value) FROM jsonb_each(video_metadata) WHERE key = ANY(:keys)) "
+                "WHERE video_metadata ->> 'secure_url' IS NOT NULL "
+                "AND EXISTS (SELECT 1 FROM jsonb_object_keys(video_metadata) AS k WHERE k <> ALL(:keys))"
+            ),
+            {"keys": list(keep_keys)}
+        )
+        logger.info("Compacted video_metadata of %s tasks.", result.rowcount)
+        return result.rowcount
+
+def delete_task_by_id(task_id_str):
+    """
+    Deletes a task by its string-based task_id (the primary key).
+
+    Args:
+        task_id_str (str): The unique task identifier string.
 
     Returns:
         bool: True if deletion was successful, False otherwise.
     """
     with session_scope() as session:
-        task = session.query(Task).get(task_primary_key)
+        task = session.get(Task, task_id_str)
         if task:
-            logger.warning(f"Deleting task ID {task.id} ('{task.task_id}') from DB.")
+            logger.warning("Deleting task '%s' from DB.", task.task_id)
             session.delete(task)
             return True
         return False
 
-def get_user_videos(instagram_username=None, email=None, linkedin_profile=None):
+def delete_tasks_by_ids(task_ids):
     """
-    Retrieves a list of videos for a user by one of the identifiers (OR logic).
+    Deletes several tasks with a single DELETE ... WHERE task_id IN (...) statement.
 
     Args:
-        instagram_username (str, optional): User's Instagram username.
-        email (str, optional): User's email.
-        linkedin_profile (str, optional): User's LinkedIn profile URL.
+        task_ids (list[str]): The task identifier strings.
 
     Returns:
-        list[dict]: A list of task dictionaries, with keys converted to camelCase.
+        int: The number of deleted rows.
     """
+    if not task_ids:
+        return 0
     with session_scope() as session:
-        conditions = []
-        if instagram_username:
-            conditions.append(Task.instagram_username == instagram_username)
-        if email:
-            conditions.append(Task.email == email)
-        if linkedin_profile:
-            conditions.append(Task.linkedin_profile == linkedin_profile)
-
-        if not conditions:
-            return []
+        deleted_rows = session.query(Task).filter(Task.task_id.in_(task_ids)).delete(synchronize_session=False)
+        logger.warning("Deleted %s tasks from DB.", deleted_rows)
+        return deleted_rows
+
+def _user_conditions(instagram_username=None, email=None, linkedin_profile=None):
+    """Builds the OR-able filter conditions for the given user identifiers."""
+    conditions = []
+    if instagram_username:
+        conditions.append(Task.instagram_username == instagram_username)
+    if email:
+        conditions.append(Task.email == email)
+    if linkedin_profile:
+        conditions.append(Task.linkedin_profile == linkedin_profile)
+    return conditions
+
+def get_user_video_refs(instagram_username=None, email=None, linkedin_profile=None):
+    """
+    Retrieves only the identifiers of a user's videos (OR logic on the identifiers),
+    newest first. It doesn't transfer video_metadata, so it's cheap enough for the
+    Cloudinary verification pass.
 
-        tasks = session.query(Task).filter(or_(*conditions)).order_by(Task.timestamp.desc()).all()
-        # CHANGED: Return a list of dictionaries to prevent DetachedInstanceError
-        return [task.to_dict() for task in tasks]
+    Returns:
+        list[tuple]: (task_id, cloudinary_public_id, status, created_at) tuples.
+    """
+    conditions = _user_conditions(instagram_username, email, linkedin_profile)
+    if not conditions:
+        return []
+    with session_scope() as session:
+        rows = session.query(Task.task_id, Task.cloudinary_public_id, Task.status, Task.created_at).filter(or_(*conditions)).order_by(Task.created_at.desc()).all()
+        return [tuple(row) for row in rows]
 
 def create_tables():
     """
     Creates all database tables defined in the Base metadata if they don't already exist.
-    This function should be called once at application startup from app.py.
+    This function should be called once per deploy via the `flask --app app init-db` command.
     """
     try:
         Base.metadata.create_all(engine)
         logger.info("Database tables checked/created successfully.")
+        ensure_columns()
+        ensure_indexes()
     except Exception as e:
-        logger.error(f"Error creating database tables: {e}", exc_info=True)
+        logger.error("Error creating database tables: %s", e, exc_info=True)
         raise
 
+def ensure_columns():
+    """
+    Adds Task columns that are missing on an existing table. create_all() never alters
+    an existing table, and every full-row read selects all model columns, so a column
+    added to the model must reach the database before the new code serves requests.
+    """
+    with engine.begin() as connection:
+        existing = {column['name'] for column in inspect(connection).get_columns(Task.__tablename__)}
+        if 'created_at' not in existing:
+            # Added without a default first, so existing rows are backfilled with their
+            # timestamp (the best creation time available) rather than the deploy time
+            connection.execute(text("ALTER TABLE tasks ADD COLUMN created_at TIMESTAMP WITH TIME ZONE"))
+            connection.execute(text("UPDATE tasks SET created_at = timestamp"))
+            if connection.dialect.name == 'postgresql':
+                connection.execute(text("ALTER TABLE tasks ALTER COLUMN created_at SET DEFAULT now()"))
+            logger.info("Added and backfilled tasks.created_at.")
+        if connection.dialect.name == 'postgresql':
+            # timestamp used to get its value from Python; inserts now rely on the server default
+            connection.execute(text("ALTER TABLE tasks ALTER COLUMN timestamp SET DEFAULT now()"))
+
+def ensure_indexes():
+    """
+    Creates any Task index that is missing on an existing table. create_all() only
+    creates indexes together with a new table, so indexes added to the model later
+    would otherwise never reach databases created before them.
+    """
+    with engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            # Building an index on a large table can take longer than the statement timeout
+            connection.execute(text("SET LOCAL statement_timeout = 0"))
+        for index in Task.__table__.indexes:
+            index.create(connection, checkfirst=True)
+    logger.info("Database indexes checked/created successfully.")
+
 # REMOVED: The automatic call to create_tables() has been removed.
-# This function should now be called explicitly from your main app file (e.g., app.py).
+# Run it explicitly with `flask --app app init-db` (see app.py) before starting the workers.
@@ -1,8 +1,12 @@
 import os
 import requests
 import json
+import logging
+import math
 import random
 
+logger = logging.getLogger(__name__)
+
 # Определяем список доступных переходов Shotstack
 # Обновлен список для соответствия строгому списку Shotstack API
 AVAILABLE_TRANSITIONS = [
@@ -52,7 +56,8 @@ def create_shotstack_payload(cloudinary_video_url_or_urls, video_metadata_list,
     else:
         processed_metadata_list = video_metadata_list
 
-    total_duration = sum(m.get('duration', 0) for m in processed_metadata_list if m)
+    # fsum суммирует без накопления ошибки округления
+    total_duration = math.fsum(m.get('duration', 0) for m in processed_metadata_list if m)
     # Гарантируем минимальную длительность, если видео слишком короткое или пустое
     if total_duration < 0.1: 
         total_duration = 0.1 
@@ -98,7 +103,7 @@ def create_shotstack_payload(cloudinary_video_url_or_urls, video_metadata_list,
             if i > 0:
                 random_in_transition = random.choice(AVAILABLE_TRANSITIONS)
                 clip_definition["transition"] = {"in": random_in_transition}
-                print(f"[ShotstackService] Added 'in' transition: '{random_in_transition}' for clip {i+1}.")
+                logger.debug("[ShotstackService] Added 'in' transition: '%s' for clip %d.", random_in_transition, i + 1)
             
             video_clips.append(clip_definition)
             current_start_time += clip_duration
@@ -148,7 +153,7 @@ def initiate_shotstack_render(cloudinary_video_url_or_urls, video_metadata, orig
     shotstack_render_url = "https://api.shotstack.io/stage/render" # Используем stage для тестирования
 
     if not shotstack_api_key:
-        print("[ShotstackService] ОШИБКА: Переменная окружения SHOTSTACK_API_KEY не установлена.")
+        logger.error("[ShotstackService] ОШИБКА: Переменная окружения SHOTSTACK_API_KEY не установлена.")
         raise ValueError("SHOTSTACK_API_KEY environment variable is not set.")
 
     headers = {
@@ -157,10 +162,10 @@ def initiate_shotstack_render(cloudinary_video_url_or_urls, video_metadata, orig
     }
 
     if connect_videos and not isinstance(video_metadata, list):
-        print("[ShotstackService] ПРЕДУПРЕЖДЕНИЕ: connect_videos равно True, но video_metadata не является списком. Это может привести к некорректному рендерингу.")
+        logger.warning("[ShotstackService] ПРЕДУПРЕЖДЕНИЕ: connect_videos равно True, но video_metadata не является списком. Это может привести к некорректному рендерингу.")
         video_metadata_for_payload = [video_metadata] if video_metadata else []
     elif not connect_videos and isinstance(video_metadata, list):
-        print("[ShotstackService] ПРЕДУПРЕЖДЕНИЕ: connect_videos равно False, но video_metadata является списком. Используем первый элемент.")
+        logger.warning("[ShotstackService] ПРЕДУПРЕЖДЕНИЕ: connect_videos равно False, но video_metadata является списком. Используем первый элемент.")
         video_metadata_for_payload = video_metadata[0] if video_metadata else {}
     else:
         video_metadata_for_payload = video_metadata
@@ -176,8 +181,10 @@ def initiate_shotstack_render(cloudinary_video_url_or_urls, video_metadata, orig
         connect_videos
     )
 
-    print(f"[ShotstackService] Отправка запроса в Shotstack API для {original_filename} (Объединение видео: {connect_videos})...")
-    print(f"[ShotstackService] JSON-payload для Shotstack: {json.dumps(payload, indent=2, ensure_ascii=False)}")
+    logger.info("[ShotstackService] Отправка запроса в Shotstack API для %s (Объединение видео: %s)...", original_filename, connect_videos)
+    # json.dumps дорогой для больших payload, поэтому выполняем его только при включённом DEBUG
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[ShotstackService] JSON-payload для Shotstack: %s", json.dumps(payload, indent=2, ensure_ascii=False))
 
     try:
         response = requests.post(shotstack_render_url, json=payload, headers=headers, timeout=30)
@@ -189,24 +196,24 @@ def initiate_shotstack_render(cloudinary_video_url_or_urls, video_metadata, orig
         if render_id:
             return render_id, "Рендеринг успешно поставлен в очередь."
         else:
-            print(f"[ShotstackService] ОШИБКА: Shotstack API не вернул ID рендеринга. Ответ: {json.dumps(result, indent=2, ensure_ascii=False)}")
+            logger.error("[ShotstackService] ОШИБКА: Shotstack API не вернул ID рендеринга. Ответ: %s", result)
             raise RuntimeError("Shotstack API не вернул ID рендеринга после успешного запроса.")
 
     except requests.exceptions.HTTPError as e:
         error_message = f"HTTP-ошибка от Shotstack: {e.response.status_code} {e.response.reason}. Подробности: {e.response.text}"
-        print(f"[ShotstackService] ОШИБКА: {error_message}")
+        logger.error("[ShotstackService] ОШИБКА: %s", error_message)
         raise requests.exceptions.RequestException(error_message) from e
     except requests.exceptions.ConnectionError as e:
         error_message = f"Ошибка подключения к Shotstack: {e}"
-        print(f"[ShotstackService] ОШИБКА: {error_message}")
+        logger.error("[ShotstackService] ОШИБКА: %s", error_message)
         raise requests.exceptions.RequestException(error_message) from e
     except requests.exceptions.Timeout as e:
         error_message = f"Тайм-аут при подключении к Shotstack: {e}"
-        print(f"[ShotstackService] ОШИБКА: {e}")
+        logger.error("[ShotstackService] ОШИБКА: %s", e)
         raise requests.exceptions.RequestException(error_message) from e
     except Exception as e:
         error_message = f"Произошла непредвиденная ошибка при вызове Shotstack API: {e}"
-        print(f"[ShotstackService] ОШИБКА: {error_message}")
+        logger.error("[ShotstackService] ОШИБКА: %s", error_message)
         raise Exception(error_message) from e
 
 
@@ -215,14 +222,14 @@ def get_shotstack_render_status(render_id):
     shotstack_status_url = f"https://api.shotstack.io/stage/render/{render_id}" # Используем stage для тестирования
 
     if not shotstack_api_key:
-        print("[ShotstackService] ОШИБКА: Переменная окружения SHOTSTACK_API_KEY не установлена.")
+        logger.error("[ShotstackService] ОШИБКА: Переменная окружения SHOTSTACK_API_KEY не установлена.")
         raise ValueError("SHOTSTACK_API_KEY environment variable is not set.")
 
     headers = {
         "x-api-key": shotstack_api_key
     }
 
-    print(f"[ShotstackService] Проверка статуса для ID рендеринга: {render_id}...")
+    logger.debug("[ShotstackService] Проверка статуса для ID рендеринга: %s...", render_id)
 
     try:
         response = requests.get(shotstack_status_url, headers=headers, timeout=15)
@@ -243,17 +250,17 @@ def get_shotstack_render_status(render_id):
 
     except requests.exceptions.HTTPError as e:
         error_message = f"HTTP-ошибка от Shotstack API статуса: {e.response.status_code} {e.response.reason}. Подробности: {e.response.text}"
-        print(f"[ShotstackService] ОШИБКА: {error_message}")
+        logger.error("[ShotstackService] ОШИБКА: %s", error_message)
         raise requests.exceptions.RequestException(error_message) from e
     except requests.exceptions.ConnectionError as e:
         error_message = f"Ошибка подключения к Shotstack API статуса: {e}"
-        print(f"[ShotstackService] ОШИБКА: {error_message}")
+        logger.error("[ShotstackService] ОШИБКА: %s", error_message)
         raise requests.exceptions.RequestException(error_message) from e
     except requests.exceptions.Timeout as e:
         error_message = f"Тайм-аут при подключении к Shotstack API статуса: {e}"
-        print(f"[ShotstackService] ОШИБКА: {e}")
+        logger.error("[ShotstackService] ОШИБКА: %s", e)
         raise requests.exceptions.RequestException(error_message) from e
     except Exception as e:
         error_message = f"Произошла непредвиденная ошибка при вызове Shotstack API статуса: {e}"
-        print(f"[ShotstackService] ОШИБКА: {error_message}")
+        logger.error("[ShotstackService] ОШИБКА: %s", error_message)
         raise Exception(error_message) from e